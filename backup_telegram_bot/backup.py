@@ -2,23 +2,410 @@
 """
 Backup functionality for the Telegram Bot
 """
+import asyncio
+import collections
+import contextlib
+import io
 import logging
-from datetime import datetime
+import queue
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
-from smb.SMBConnection import SMBConnection
+import smbclient
+from smbprotocol.exceptions import SMBOSError
+from smbprotocol.header import NtStatus
 
 from backup_telegram_bot.config import (
     SMB_USERNAME,
     SMB_PASSWORD,
     SMB_SERVER,
-    SMB_SERVER_NAME,
     SMB_SHARE,
     SMB_PORT,
+    SMB_POOL_SIZE,
+    SMB_REQUIRE_SIGNING,
+    SMB_SOCKET_BUFFER_SIZE,
     BACKUP_DIRECTORY,
 )
 
 logger = logging.getLogger(__name__)
 
+# Streamed uploads hold at most PIPE_DEPTH chunks in memory. Chunks start at
+# PIPE_MIN_CHUNK_SIZE and double up to PIPE_CHUNK_SIZE, so small files such as
+# stickers and voice notes never allocate a full-size chunk. Both sizes are
+# multiples of the usual 64 KiB SMB write size.
+PIPE_MIN_CHUNK_SIZE = 16 * 1024
+PIPE_CHUNK_SIZE = 4 * 1024 * 1024
+PIPE_DEPTH = 8
+
+# Uploads are copied in COPY_CHUNK_SIZE reads into a remote file buffered to the
+# maximum write size negotiated with the server (up to 8 MiB on SMB 3), so every
+# buffer flush is sent as a single SMB2 WRITE.
+COPY_CHUNK_SIZE = 1024 * 1024
+
+
+def copy_file(src, dst, buffer):
+    """
+    Copy src to dst through a reused buffer
+
+    Unlike shutil.copyfileobj, which allocates a new bytes object per read,
+    every read lands in the same buffer via readinto().
+    """
+    view = memoryview(buffer)
+    while True:
+        size = src.readinto(view)
+        if not size:
+            break
+        dst.write(view[:size])
+
+
+class BufferPool:
+    """A bounded set of copy buffers reused by all uploads"""
+
+    def __init__(self, count, size):
+        """
+        Initialize an empty pool, buffers are allocated on first use
+
+        Args:
+            count (int): Maximum number of buffers to allocate
+            size (int): Size of each buffer in bytes
+        """
+        self.count = count
+        self.size = size
+        self._free = queue.LifoQueue()
+        self._allocated = 0
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def borrow(self):
+        """Borrow a buffer for the duration of a ``with`` block, waiting if all are in use"""
+        buffer = self._take()
+        try:
+            yield buffer
+        finally:
+            self._free.put(buffer)
+
+    def _take(self):
+        """Take a free buffer, allocate a new one while under the limit, or wait"""
+        try:
+            return self._free.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            if self._allocated < self.count:
+                self._allocated += 1
+                return bytearray(self.size)
+
+        return self._free.get()
+
+
+class ChunkedPipe(io.RawIOBase):
+    """
+    A bounded in-memory pipe between a downloading producer and an uploading consumer
+
+    write() blocks while the pipe is full and readinto() blocks while it is
+    empty, so memory use stays below PIPE_CHUNK_SIZE * PIPE_DEPTH per upload
+    no matter how large the file is. Reallocating while the chunks grow is
+    cheap next to the network transfer they feed.
+    """
+
+    def __init__(self, depth=PIPE_DEPTH):
+        """Initialize an empty pipe holding up to depth chunks"""
+        super().__init__()
+        self._chunks = collections.deque(maxlen=depth)
+        self._buf = bytearray()  # Chunk being filled by the producer
+        self._cap = PIPE_MIN_CHUNK_SIZE
+        self._cond = threading.Condition()
+        self._head = memoryview(b"")  # Unread rest of the chunk being consumed
+        self._eof = False
+        self._error = None
+
+    def readable(self):
+        return True
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        """Copy b into the current chunk, queuing every chunk that fills up"""
+        data = memoryview(b)
+        with self._cond:
+            while data:
+                space = self._cap - len(self._buf)
+                self._buf.extend(data[:space])
+                data = data[space:]
+                if len(self._buf) == self._cap:
+                    self._push()
+        return len(b)
+
+    def finish(self):
+        """Queue the last partial chunk and signal that no more data will be written"""
+        with self._cond:
+            if self._buf:
+                self._push()
+            self._eof = True
+            self._cond.notify_all()
+
+    def _push(self):
+        """Queue the current chunk, waiting for the consumer to make room if needed"""
+        self._cond.wait_for(lambda: len(self._chunks) < self._chunks.maxlen or self.closed)
+        if self.closed:
+            raise BrokenPipeError("The reading side of the pipe is closed")
+
+        self._chunks.append(self._buf)
+        self._buf = bytearray()
+        self._cap = min(self._cap * 2, PIPE_CHUNK_SIZE)
+        self._cond.notify_all()
+
+    def abort(self, error):
+        """Make the consumer fail with error instead of reading further"""
+        with self._cond:
+            self._error = error
+            self._cond.notify_all()
+
+    def readinto(self, b):
+        """
+        Fill b from the queued chunks, waiting for the producer as needed
+
+        Reads only come back short at the end of the stream, so every SMB write
+        issued from them carries as much data as the caller asked for, even
+        across the small chunks at the start of a file.
+        """
+        view = memoryview(b).cast("B")
+        filled = 0
+        with self._cond:
+            while filled < len(view):
+                self._cond.wait_for(
+                    lambda: self._head or self._chunks or self._eof or self._error or self.closed
+                )
+                if self._error is not None:
+                    raise self._error
+
+                if not self._head and self._chunks:
+                    self._head = memoryview(self._chunks.popleft())
+                    self._cond.notify_all()
+
+                if not self._head:
+                    if self._eof:
+                        break
+                    raise BrokenPipeError("The writing side of the pipe is closed")
+
+                size = min(len(view) - filled, len(self._head))
+                view[filled:filled + size] = self._head[:size]
+                self._head = self._head[size:]
+                filled += size
+
+        return filled
+
+    def close(self):
+        """Close the pipe, waking up both sides"""
+        with self._cond:
+            super().close()
+            self._cond.notify_all()
+
+
+class SMBSession:
+    """An authenticated smbclient session on a TCP connection of its own"""
+
+    def __init__(self, server, port, username, password, require_signing, socket_buffer_size=0):
+        """
+        Connect and authenticate to the SMB server
+
+        Args:
+            server (str): Hostname or IP address of the server
+            port (int): TCP port of the server
+            username (str): User to authenticate as
+            password (str): Password of the user
+            require_signing (bool): Sign every message even if the server doesn't require it
+            socket_buffer_size (int): Send buffer size of the socket, 0 leaves it to the kernel
+        """
+        # smbclient shares one connection per server through its cache, a private
+        # cache gives every pooled session a separate connection
+        self.connection_cache = {}
+        try:
+            self.session = smbclient.register_session(
+                server,
+                username=username,
+                password=password,
+                port=port,
+                connection_cache=self.connection_cache,
+                require_signing=require_signing,
+            )
+        except Exception:
+            # The connection is cached before authenticating, close its socket
+            # and receive thread instead of leaking them on every failed attempt
+            smbclient.reset_connection_cache(fail_on_error=False, connection_cache=self.connection_cache)
+            raise
+        # Passed to smbclient calls so they run on this session, and reconnect
+        # with the same settings if its connection has dropped
+        self.client_kwargs = {
+            "username": username,
+            "password": password,
+            "port": port,
+            "connection_cache": self.connection_cache,
+            "require_signing": require_signing,
+        }
+        self._tune_socket(socket_buffer_size)
+
+    def _tune_socket(self, buffer_size):
+        """Tune the TCP socket of the connection for bulk uploads"""
+        # smbprotocol doesn't expose its socket, skip tuning if its internals change
+        sock = getattr(self.session.connection.transport, "_sock", None)
+        if sock is None:
+            return
+
+        try:
+            # Every SMB2 WRITE waits for its response, don't let Nagle hold back
+            # the tail of a request waiting for an ACK
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            if buffer_size:
+                # A fixed size disables kernel autotuning, size it to the
+                # bandwidth-delay product of the link (bandwidth * RTT). Only the
+                # send buffer matters for uploads, and the receive window scale
+                # is fixed by the handshake, which happened in register_session.
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, buffer_size)
+                # Linux silently caps the size at net.core.wmem_max (and reports
+                # double the size it uses)
+                effective = sock.getsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF)
+                if effective < buffer_size:
+                    logger.warning(
+                        "SMB socket send buffer capped at %s bytes instead of %s, raise net.core.wmem_max",
+                        effective,
+                        buffer_size,
+                    )
+        except OSError as e:
+            logger.warning("Could not tune SMB socket: %s", e)
+
+    @property
+    def max_write_size(self):
+        """Largest payload the server accepts in a single SMB2 WRITE"""
+        return self.session.connection.max_write_size
+
+    def echo(self):
+        """Send an SMB2 ECHO, raising if the connection is dead"""
+        # Windows servers close the connection on an echo without a valid session id
+        self.session.connection.echo(sid=self.session.session_id)
+
+    def close(self):
+        """Log off and close the connection"""
+        smbclient.reset_connection_cache(fail_on_error=False, connection_cache=self.connection_cache)
+
+
+class SMBConnectionPool:
+    """
+    A bounded pool of authenticated SMB connections
+
+    smbclient is blocking, so every call on a pooled connection is run on the
+    pool's own worker threads (one per connection) to keep the event loop free.
+    """
+
+    def __init__(self, connect, max_size):
+        """
+        Initialize an empty pool
+
+        Args:
+            connect (callable): Opens a new connection, returns None on failure
+            max_size (int): Maximum number of connections open at the same time
+        """
+        self.max_size = max_size
+        self._connect = connect
+        self._idle = asyncio.Queue()
+        # Each borrower holds one slot, so at most max_size connections exist
+        self._slots = asyncio.Semaphore(max_size)
+        self._executor = ThreadPoolExecutor(max_workers=max_size, thread_name_prefix="smb")
+
+    @contextlib.asynccontextmanager
+    async def acquire(self):
+        """
+        Borrow a live connection for the duration of an ``async with`` block
+
+        The connection is returned to the pool when the block exits normally
+        and closed if the block raises.
+        """
+        await self._slots.acquire()
+        try:
+            conn = await self._checkout()
+        except BaseException:
+            self._slots.release()
+            raise
+
+        try:
+            yield conn
+        except BaseException:
+            self.release(conn, failed=True)
+            raise
+        self.release(conn)
+
+    def release(self, conn, failed=False):
+        """
+        Give a borrowed connection back to the pool
+
+        Args:
+            conn (SMBSession): Connection obtained from acquire()
+            failed (bool): Close the connection instead of reusing it
+        """
+        if failed:
+            self._executor.submit(self._close, conn)
+        else:
+            self._idle.put_nowait(conn)
+        self._slots.release()
+
+    async def run(self, func, *args):
+        """
+        Run a blocking function on the pool's worker threads
+
+        Args:
+            func (callable): Function to call, usually one taking a connection
+            *args: Positional arguments for func
+
+        Returns:
+            The return value of func
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    async def close(self):
+        """Close all idle connections in parallel and stop the worker threads"""
+        conns = []
+        while not self._idle.empty():
+            conns.append(self._idle.get_nowait())
+
+        await asyncio.gather(*(self.run(self._close, conn) for conn in conns))
+        self._executor.shutdown(wait=False)
+
+    async def _checkout(self):
+        """Take an idle connection that still answers, or open a new one"""
+        while not self._idle.empty():
+            conn = self._idle.get_nowait()
+            if await self.run(self._probe, conn):
+                return conn
+
+        conn = await self.run(self._connect)
+        if not conn:
+            raise ConnectionError("Could not connect to the SMB server")
+        return conn
+
+    @classmethod
+    def _probe(cls, conn):
+        """Check that a connection still answers, closing it if it does not"""
+        try:
+            conn.echo()
+            return True
+        except Exception as e:
+            logger.warning("Dropping dead SMB connection: %s", e)
+            cls._close(conn)
+            return False
+
+    @staticmethod
+    def _close(conn):
+        """Close a connection, ignoring errors from a dead socket"""
+        try:
+            conn.close()
+        except Exception:
+            pass
+
 
 class BackupManager:
     """Manages file backups to an SMB server"""
@@ -28,16 +415,24 @@ class BackupManager:
         self.smb_username = SMB_USERNAME
         self.smb_password = SMB_PASSWORD
         self.smb_server = SMB_SERVER
-        self.smb_server_name = SMB_SERVER_NAME
         self.smb_share = SMB_SHARE
         self.smb_port = SMB_PORT
+        self.smb_require_signing = SMB_REQUIRE_SIGNING
+        self.smb_socket_buffer_size = SMB_SOCKET_BUFFER_SIZE
         self.backup_directory = BACKUP_DIRECTORY
+        self._backup_dir = self.backup_directory.rstrip('/')
 
-        # Check if all required SMB settings are provided
+        # Check if all required SMB settings are provided and valid
         self._check_settings()
 
+        # Connections are opened on demand and kept for reuse between backups
+        self.pool = SMBConnectionPool(self.connect, SMB_POOL_SIZE)
+        # Copy buffers are likewise kept for reuse instead of allocated per upload.
+        # They are only borrowed on the pool's worker threads, one per connection.
+        self.buffers = BufferPool(SMB_POOL_SIZE, COPY_CHUNK_SIZE)
+
     def _check_settings(self):
-        """Check if all required SMB settings are provided"""
+        """Check if all required SMB settings are provided and valid"""
         required_settings = {
             "SMB_USERNAME": self.smb_username,
             "SMB_PASSWORD": self.smb_password,
@@ -47,93 +442,163 @@ class BackupManager:
         missing = [key for key, value in required_settings.items() if not value]
 
         if missing:
-            logger.error(f"Missing required SMB settings: {', '.join(missing)}")
+            logger.error("Missing required SMB settings: %s", ', '.join(missing))
             raise ValueError(f"Missing required SMB settings: {', '.join(missing)}")
 
+        if SMB_POOL_SIZE < 1:
+            logger.error("SMB_POOL_SIZE must be at least 1, got %s", SMB_POOL_SIZE)
+            raise ValueError(f"SMB_POOL_SIZE must be at least 1, got {SMB_POOL_SIZE}")
+
     def connect(self):
         """Establish connection to the SMB server"""
         try:
-            # Create the SMB connection
-            conn = SMBConnection(
+            # Negotiates the highest dialect both sides support, SMB 3.1.1 on current servers
+            return SMBSession(
+                self.smb_server,
+                self.smb_port,
                 self.smb_username,
                 self.smb_password,
-                "TelegramBackupBot",  # client_name
-                self.smb_server_name,  # server_name
-                use_ntlm_v2=True,
-                is_direct_tcp=True,
+                self.smb_require_signing,
+                self.smb_socket_buffer_size,
             )
 
-            # Connect to the server
-            connected = conn.connect(self.smb_server, self.smb_port)
+        except Exception as e:
+            logger.error("Error connecting to SMB server: %s", e)
+            return None
 
-            if not connected:
-                logger.error(f"Failed to connect to SMB server {self.smb_server}")
-                return None
+    async def is_connected(self):
+        """
+        Check that the SMB server is reachable
 
-            return conn
+        Returns:
+            bool: True if a live connection is available, False otherwise
+        """
+        try:
+            async with self.pool.acquire():
+                return True
+        except Exception:
+            return False
 
-        except Exception as e:
-            logger.error(f"Error connecting to SMB server: {e}")
-            return None
+    async def close(self):
+        """Close all pooled SMB connections"""
+        await self.pool.close()
 
-    def backup_file(self, file_path, original_filename):
+    async def backup_stream(self, chunks, original_filename):
         """
-        Backup a file to the SMB server
+        Backup a file to the SMB server while it is still being downloaded
+
+        The chunks are passed to the upload thread through a ChunkedPipe, so the
+        file is neither staged on local disk nor held in memory as a whole.
 
         Args:
-            file_path (str): Local path to the downloaded file
+            chunks (AsyncIterable[bytes]): File content, in order
             original_filename (str): Original filename to preserve
 
         Returns:
             bool: True if backup was successful, False otherwise
         """
-        conn = self.connect()
-        if not conn:
+        loop = asyncio.get_running_loop()
+        pipe = ChunkedPipe()
+
+        try:
+            async with self.pool.acquire() as conn:
+                upload = asyncio.ensure_future(self.pool.run(self._store, conn, pipe, original_filename))
+                # Once the upload stops reading, pending writes fail instead of blocking
+                upload.add_done_callback(lambda _: pipe.close())
+
+                try:
+                    # Writes wait while the pipe is full, keep that off the event loop
+                    async for chunk in chunks:
+                        await loop.run_in_executor(None, pipe.write, chunk)
+                    await loop.run_in_executor(None, pipe.finish)
+                except BrokenPipeError:
+                    # The upload failed early, its own error is raised below
+                    pass
+                except Exception as e:
+                    # Fail the upload as well, so it removes the partial file
+                    pipe.abort(e)
+
+                await upload
+            return True
+
+        except Exception as e:
+            logger.error("Error backing up file: %s", e)
             return False
 
+        finally:
+            pipe.close()
+
+    def _store(self, conn, file_obj, original_filename):
+        """
+        Upload a file object to the backup directory over an open connection
+
+        Returns:
+            str: Path of the uploaded file on the share
+        """
+        # Prepare the file path for upload
+        upload_path = f"{self._backup_dir}/{original_filename}"
+
+        # Creating the file fails if one with the same name already exists, which
+        # saves checking for it first on every upload
         try:
-            # Ensure backup directory exists
-            try:
-                conn.createDirectory(self.smb_share, self.backup_directory.rstrip('/'))
-            except Exception:
-                # Directory might already exist
-                pass
+            remote_file = self._create_remote_file(conn, upload_path)
+        except SMBOSError as e:
+            if e.ntstatus != NtStatus.STATUS_OBJECT_NAME_COLLISION:
+                raise
 
-            # Prepare the file path for upload
-            upload_path = f"{self.backup_directory.rstrip('/')}/{original_filename}"
+            # File exists, append a timestamp as postfix
+            timestamp = time.strftime("_%Y%m%d_%H%M%S")
+            name_parts = original_filename.rsplit('.', 1)
+            if len(name_parts) > 1:
+                # If file has extension
+                filename_without_ext, ext = name_parts
+                new_filename = f"{filename_without_ext}{timestamp}.{ext}"
+            else:
+                # If file has no extension
+                new_filename = f"{original_filename}{timestamp}"
 
-            # Check if file with same name already exists
+            upload_path = f"{self._backup_dir}/{new_filename}"
+            remote_file = self._create_remote_file(conn, upload_path)
+
+        # Upload the file to the SMB server
+        try:
+            with remote_file, self.buffers.borrow() as buffer:
+                copy_file(file_obj, remote_file, buffer)
+        except Exception:
+            # Don't leave a partially written file behind
             try:
-                file_info = conn.getAttributes(self.smb_share, upload_path)
-                if file_info:
-                    # File exists, append a timestamp as postfix
-                    name_parts = original_filename.rsplit('.', 1)
-                    if len(name_parts) > 1:
-                        # If file has extension
-                        filename_without_ext, ext = name_parts
-                        timestamp = datetime.now().strftime("_%Y%m%d_%H%M%S")
-                        new_filename = f"{filename_without_ext}{timestamp}.{ext}"
-                    else:
-                        # If file has no extension
-                        timestamp = datetime.now().strftime("_%Y%m%d_%H%M%S")
-                        new_filename = f"{original_filename}{timestamp}"
-
-                    upload_path = f"{self.backup_directory.rstrip('/')}/{new_filename}"
+                smbclient.remove(self._unc_path(upload_path), **conn.client_kwargs)
             except Exception:
-                # File doesn't exist, we can use the original filename
                 pass
+            raise
 
-            # Open the local file for reading
-            with open(file_path, "rb") as file_obj:
-                # Upload the file to the SMB server
-                conn.storeFile(self.smb_share, upload_path, file_obj)
+        logger.info("Successfully backed up file to %s", upload_path)
+        return upload_path
 
-            logger.info(f"Successfully backed up file to {upload_path}")
-            conn.close()
-            return True
+    def _create_remote_file(self, conn, upload_path):
+        """
+        Create a new remote file for writing, creating the backup directory if it is missing
 
-        except Exception as e:
-            logger.error(f"Error backing up file: {e}")
-            if conn:
-                conn.close()
-            return False
+        Raises:
+            SMBOSError: With STATUS_OBJECT_NAME_COLLISION if the file already exists
+        """
+        remote_path = self._unc_path(upload_path)
+        try:
+            return smbclient.open_file(
+                remote_path, mode="xb", buffering=conn.max_write_size, **conn.client_kwargs
+            )
+        except SMBOSError as e:
+            if e.ntstatus not in (NtStatus.STATUS_OBJECT_PATH_NOT_FOUND, NtStatus.STATUS_OBJECT_NAME_NOT_FOUND):
+                raise
+
+        # Only create the directory once an upload finds it missing, which saves
+        # a round trip on every upload once it exists
+        smbclient.makedirs(self._unc_path(self._backup_dir), exist_ok=True, **conn.client_kwargs)
+        return smbclient.open_file(
+            remote_path, mode="xb", buffering=conn.max_write_size, **conn.client_kwargs
+        )
+
+    def _unc_path(self, path):
+        """Turn a path on the share into the UNC path smbclient expects"""
+        parts = [part for part in path.split('/') if part]
+        return "\\\\" + "\\".join([self.smb_server, self.smb_share, *parts])
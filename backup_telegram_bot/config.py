@@ -20,7 +20,11 @@ AUTHORIZED_USER_ID = int(os.environ.get("AUTHORIZED_USER_ID", 0))
 SMB_USERNAME = os.environ.get("SMB_USERNAME")
 SMB_PASSWORD = os.environ.get("SMB_PASSWORD")
 SMB_SERVER = os.environ.get("SMB_SERVER")
-SMB_SERVER_NAME = os.environ.get("SMB_SERVER_NAME", "")
 SMB_SHARE = os.environ.get("SMB_SHARE")
 SMB_PORT = int(os.environ.get("SMB_PORT", 445))
-BACKUP_DIRECTORY = os.environ.get("BACKUP_DIRECTORY", "/")
\ No newline at end of file
+SMB_POOL_SIZE = int(os.environ.get("SMB_POOL_SIZE", 3))
+SMB_REQUIRE_SIGNING = os.environ.get("SMB_REQUIRE_SIGNING", "false").lower() in ("1", "true", "yes")
+SMB_SOCKET_BUFFER_SIZE = int(os.environ.get("SMB_SOCKET_BUFFER_SIZE", 0))
+PHOTO_SIZE = os.environ.get("PHOTO_SIZE", "largest").lower()
+BACKUP_DIRECTORY = os.environ.get("BACKUP_DIRECTORY", "/")
+BACKUP_HISTORY_FILE = os.environ.get("BACKUP_HISTORY_FILE", "")
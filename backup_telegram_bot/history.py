@@ -0,0 +1,46 @@
+#!/usr/bin/env python
+"""
+Backup history module for Backup Telegram Bot
+Remembers which Telegram files have already been backed up
+"""
+import sqlite3
+import time
+
+
+class BackupHistory:
+    """The files already backed up, keyed by their Telegram file_unique_id"""
+
+    def __init__(self, path):
+        """
+        Open the history, creating it if it doesn't exist yet
+
+        Args:
+            path (str): SQLite database file, empty to keep the history in memory only
+        """
+        # Only used from the event loop thread, autocommit each statement
+        self._db = sqlite3.connect(path or ":memory:", isolation_level=None)
+        # WAL with synchronous=NORMAL doesn't fsync on every insert
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS backed_up ("
+            "file_unique_id TEXT PRIMARY KEY, backed_up_at REAL NOT NULL)"
+        )
+
+    def __contains__(self, file_unique_id):
+        """Check if a file has already been backed up"""
+        row = self._db.execute(
+            "SELECT 1 FROM backed_up WHERE file_unique_id = ?", (file_unique_id,)
+        ).fetchone()
+        return row is not None
+
+    def add(self, file_unique_id):
+        """Record a file as backed up"""
+        self._db.execute(
+            "INSERT OR IGNORE INTO backed_up (file_unique_id, backed_up_at) VALUES (?, ?)",
+            (file_unique_id, time.time()),
+        )
+
+    def close(self):
+        """Close the database"""
+        self._db.close()
@@ -2,406 +2,257 @@
 """
 Main module for the Backup Telegram Bot
 """
+import asyncio
 import logging
-import os
-import tempfile
+import sqlite3
 
-from telegram import Update
+import httpx
+from telegram import File, Update
 from telegram.ext import (
     Application,
+    ApplicationHandlerStop,
     CommandHandler,
     ContextTypes,
     MessageHandler,
+    TypeHandler,
     filters,
 )
 
 from backup_telegram_bot.backup import BackupManager
-from backup_telegram_bot.config import AUTHORIZED_USER_ID, TELEGRAM_BOT_TOKEN
-
-# Enable logging
-logging.basicConfig(
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO
+from backup_telegram_bot.config import (
+    AUTHORIZED_USER_ID,
+    BACKUP_HISTORY_FILE,
+    PHOTO_SIZE,
+    SMB_POOL_SIZE,
+    TELEGRAM_BOT_TOKEN,
 )
-# Set higher logging level for httpx to avoid excessive log output
-logging.getLogger("httpx").setLevel(logging.WARNING)
-logger = logging.getLogger(__name__)
+from backup_telegram_bot.history import BackupHistory
 
+try:
+    import uvloop
+except ImportError:
+    # Optional, not available on Windows
+    uvloop = None
 
-def check_user_authorized(user_id: int) -> bool:
-    """Check if the user is authorized to use the bot."""
-    if not AUTHORIZED_USER_ID:
-        logger.error("No authorized user ID set. Set AUTHORIZED_USER_ID environment variable.")
-        return False
+logger = logging.getLogger(__name__)
 
-    return user_id == AUTHORIZED_USER_ID
 
+# Users allowed to use the bot, empty if AUTHORIZED_USER_ID is not set
+_AUTHORIZED = frozenset({AUTHORIZED_USER_ID}) if AUTHORIZED_USER_ID else frozenset()
 
-# Define command handlers
-async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Send a message when the command /start is issued."""
-    user = update.effective_user
-    user_id = user.id
-
-    if not check_user_authorized(user_id):
-        await update.message.reply_text("Sorry, you are not authorized to use this bot.")
-        logger.warning(f"Unauthorized access attempt from user {user_id}")
-        return
-
-    await update.message.reply_text(
-        f"Hi {user.first_name}! I'm your backup bot. Use /help to see available commands."
-    )
+# Reply to commands and files sent by everyone else
+_UNAUTHORIZED_MESSAGE = "Sorry, you are not authorized to use this bot."
 
 
-async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Send a message when the command /help is issued."""
-    user_id = update.effective_user.id
+def check_user_authorized(user_id: int) -> bool:
+    """Check if the user is authorized to use the bot."""
+    return user_id in _AUTHORIZED
 
-    if not check_user_authorized(user_id):
-        await update.message.reply_text("Sorry, you are not authorized to use this bot.")
-        return
 
-    help_text = (
-        "I can help you back up files to your SMB server.\n\n"
-        "Just send me any file, document, photo, video, or forward a message "
-        "containing files, and I'll back them up automatically.\n\n"
-        "Available commands:\n"
-        "/start - Start the bot\n"
-        "/help - Show this help message\n"
-        "/status - Check the bot and SMB connection status"
-    )
-    await update.message.reply_text(help_text)
+# Index into the sizes of a photo, which Telegram sorts from smallest to largest.
+# Medium has no fixed index, it is the middle of however many sizes there are.
+_PHOTO_SIZE_INDEX = {"smallest": 0, "medium": None, "largest": -1}.get(PHOTO_SIZE, -1)
 
 
-async def status_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Check the status of the bot and SMB connection."""
-    user_id = update.effective_user.id
+# Filenames for each kind of media. Each function takes the media attribute of a
+# message and returns the file object to back up and the filename to store it as.
+def document_file(document):
+    """Back up a document under its original filename."""
+    return document, document.file_name
 
-    if not check_user_authorized(user_id):
-        await update.message.reply_text("Sorry, you are not authorized to use this bot.")
-        return
 
-    # Try to connect to SMB server to test connection
-    backup_manager = BackupManager()
-    conn = backup_manager.connect()
-
-    if conn:
-        conn.close()
-        status_text = (
-            "✅ Bot is operational\n"
-            "✅ SMB connection successful\n"
-            f"Server: {backup_manager.smb_server}\n"
-            f"Share: {backup_manager.smb_share}\n"
-            f"Backup directory: {backup_manager.backup_directory}"
-        )
+def photo_file(photos):
+    """Back up the size of a photo picked by PHOTO_SIZE."""
+    if _PHOTO_SIZE_INDEX is None:
+        photo = photos[len(photos) // 2]
     else:
-        status_text = (
-            "✅ Bot is operational\n"
-            "❌ SMB connection failed\n"
-            "Please check your SMB server settings."
-        )
-
-    await update.message.reply_text(status_text)
-
-
-async def handle_document(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Handle incoming documents and files."""
-    user_id = update.effective_user.id
-
-    if not check_user_authorized(user_id):
-        await update.message.reply_text("Sorry, you are not authorized to use this bot.")
-        return
-
-    # Process the document
-    document = update.message.document
-    if not document:
-        await update.message.reply_text("No document found in the message.")
-        return
-
-    await process_file(update, context, document, document.file_name)
-
-
-async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Handle incoming photos."""
-    user_id = update.effective_user.id
-
-    if not check_user_authorized(user_id):
-        await update.message.reply_text("Sorry, you are not authorized to use this bot.")
-        return
-
-    # Get the largest photo
-    photos = update.message.photo
-    if not photos:
-        await update.message.reply_text("No photo found in the message.")
-        return
-
-    # Photo objects are sorted by size, get the largest one (highest resolution)
-    photo = photos[-1]
-    # Generate a filename with timestamp since photos don't have filenames
-    filename = f"photo_{photo.file_unique_id}.jpg"
-
-    await process_file(update, context, photo, filename)
-
+        photo = photos[_PHOTO_SIZE_INDEX]
+    # Photos don't have filenames, so name them after their unique ID
+    return photo, f"photo_{photo.file_unique_id}.jpg"
 
-async def handle_video(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Handle incoming videos."""
-    user_id = update.effective_user.id
 
-    if not check_user_authorized(user_id):
-        await update.message.reply_text("Sorry, you are not authorized to use this bot.")
-        return
+def video_file(video):
+    """Back up a video under its filename or a generated one."""
+    return video, video.file_name or f"video_{video.file_unique_id}.mp4"
 
-    # Process the video
-    video = update.message.video
-    if not video:
-        await update.message.reply_text("No video found in the message.")
-        return
 
-    # Use file_name if available or generate one
-    filename = video.file_name if video.file_name else f"video_{video.file_unique_id}.mp4"
+def audio_file(audio):
+    """Back up an audio file under its filename or a generated one."""
+    return audio, audio.file_name or f"audio_{audio.file_unique_id}.mp3"
 
-    await process_file(update, context, video, filename)
 
+def voice_file(voice):
+    """Back up a voice message."""
+    return voice, f"voice_{voice.file_unique_id}.ogg"
 
-async def handle_audio(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Handle incoming audio files."""
-    user_id = update.effective_user.id
 
-    if not check_user_authorized(user_id):
-        await update.message.reply_text("Sorry, you are not authorized to use this bot.")
-        return
-
-    # Process the audio
-    audio = update.message.audio
-    if not audio:
-        await update.message.reply_text("No audio found in the message.")
-        return
-
-    # Use file_name if available or generate one
-    filename = audio.file_name if audio.file_name else f"audio_{audio.file_unique_id}.mp3"
+def sticker_file(sticker):
+    """Back up a sticker with the extension matching its format."""
+    extension = "webp"
+    if sticker.is_animated:
+        extension = "tgs"
+    elif sticker.is_video:
+        extension = "webm"
 
-    await process_file(update, context, audio, filename)
+    return sticker, f"sticker_{sticker.file_unique_id}.{extension}"
 
 
-async def handle_voice(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Handle incoming voice messages."""
-    user_id = update.effective_user.id
+def animation_file(animation):
+    """Back up an animation under its filename or a generated one."""
+    return animation, animation.file_name or f"animation_{animation.file_unique_id}.gif"
 
-    if not check_user_authorized(user_id):
-        await update.message.reply_text("Sorry, you are not authorized to use this bot.")
-        return
 
-    # Process the voice message
-    voice = update.message.voice
-    if not voice:
-        await update.message.reply_text("No voice message found.")
-        return
+def video_note_file(video_note):
+    """Back up a video note (round video)."""
+    return video_note, f"video_note_{video_note.file_unique_id}.mp4"
 
-    # Generate a filename for the voice message
-    filename = f"voice_{voice.file_unique_id}.ogg"
 
-    await process_file(update, context, voice, filename)
+# Message attributes that can hold a file, in the order they are checked
+MEDIA_EXTRACTORS = [
+    ("document", document_file),
+    ("photo", photo_file),
+    ("video", video_file),
+    ("audio", audio_file),
+    ("voice", voice_file),
+    ("sticker", sticker_file),
+    ("animation", animation_file),
+    ("video_note", video_note_file),
+]
 
 
-async def handle_sticker(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Handle stickers."""
-    user_id = update.effective_user.id
+def find_media(message):
+    """Return the file object and filename of the first file found in a message, or None."""
+    for attr, extract in MEDIA_EXTRACTORS:
+        media = getattr(message, attr)
+        if media:
+            # Only the matching kind of media builds its filename
+            return extract(media)
+    return None
+
+
+# Messages carrying any kind of file in MEDIA_EXTRACTORS
+MEDIA_FILTER = (
+    filters.Document.ALL
+    | filters.PHOTO
+    | filters.VIDEO
+    | filters.AUDIO
+    | filters.VOICE
+    | filters.Sticker.ALL
+    | filters.ANIMATION
+    | filters.VIDEO_NOTE
+)
 
-    if not check_user_authorized(user_id):
-        await update.message.reply_text("Sorry, you are not authorized to use this bot.")
-        return
+# Messages that try to use the bot, i.e. commands and files to back up
+_USES_BOT = filters.COMMAND | MEDIA_FILTER
 
-    # Process the sticker
-    sticker = update.message.sticker
-    if not sticker:
-        await update.message.reply_text("No sticker found in the message.")
-        return
 
-    # Generate a filename for the sticker
-    extension = "webp"
-    if sticker.is_animated:
-        extension = "tgs"
-    elif sticker.is_video:
-        extension = "webm"
+async def auth_gate(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Stop updates from unauthorized users before any other handler runs."""
+    user = update.effective_user
+    if user is None:
+        # Nobody to authorize, e.g. channel posts, drop them without a reply
+        raise ApplicationHandlerStop
 
-    filename = f"sticker_{sticker.file_unique_id}.{extension}"
+    if not check_user_authorized(user.id):
+        # Only answer attempts to use the bot, other messages (plain text, group
+        # service messages) are dropped without a reply
+        if update.message and _USES_BOT.check_update(update):
+            logger.warning("Unauthorized access attempt from user %s", user.id)
+            await update.message.reply_text(_UNAUTHORIZED_MESSAGE)
+        raise ApplicationHandlerStop
 
-    await process_file(update, context, sticker, filename)
 
+# Define command handlers
+async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Send a message when the command /start is issued."""
+    user = update.effective_user
 
-async def handle_animation(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Handle animations (GIFs)."""
-    user_id = update.effective_user.id
+    await update.message.reply_text(
+        f"Hi {user.first_name}! I'm your backup bot. Use /help to see available commands."
+    )
 
-    if not check_user_authorized(user_id):
-        await update.message.reply_text("Sorry, you are not authorized to use this bot.")
-        return
 
-    # Process the animation
-    animation = update.message.animation
-    if not animation:
-        await update.message.reply_text("No animation found in the message.")
-        return
+async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Send a message when the command /help is issued."""
+    help_text = (
+        "I can help you back up files to your SMB server.\n\n"
+        "Just send me any file, document, photo, video, or forward a message "
+        "containing files, and I'll back them up automatically.\n\n"
+        "Available commands:\n"
+        "/start - Start the bot\n"
+        "/help - Show this help message\n"
+        "/status - Check the bot and SMB connection status"
+    )
+    await update.message.reply_text(help_text)
 
-    # Use file_name if available or generate one
-    filename = animation.file_name if animation.file_name else f"animation_{animation.file_unique_id}.gif"
 
-    await process_file(update, context, animation, filename)
+async def status_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Check the status of the bot and SMB connection."""
+    # Borrow a pooled SMB connection, reconnecting if it has dropped
+    backup_manager = context.bot_data["backup_manager"]
 
+    if await backup_manager.is_connected():
+        status_text = context.bot_data["status_ok"]
+    else:
+        status_text = context.bot_data["status_fail"]
 
-async def handle_video_note(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Handle video notes (round videos)."""
-    user_id = update.effective_user.id
+    await update.message.reply_text(status_text)
 
-    if not check_user_authorized(user_id):
-        await update.message.reply_text("Sorry, you are not authorized to use this bot.")
-        return
 
-    # Process the video note
-    video_note = update.message.video_note
-    if not video_note:
-        await update.message.reply_text("No video note found in the message.")
+async def handle_media(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Handle incoming files of every supported type."""
+    media = find_media(update.message)
+    if not media:
+        await update.message.reply_text("No file found in the message.")
         return
 
-    # Generate a filename for the video note
-    filename = f"video_note_{video_note.file_unique_id}.mp4"
-
-    await process_file(update, context, video_note, filename)
+    await process_file(update, context, *media)
 
 
 async def handle_forwarded_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Handle forwarded messages that might contain files."""
-    user_id = update.effective_user.id
-
-    if not check_user_authorized(user_id):
-        await update.message.reply_text("Sorry, you are not authorized to use this bot.")
-        return
-
-    message = update.message
-
-    # Check if this is a forwarded message
-    if not message.forward_date:
-        return  # Not a forwarded message
-
-    # Try to identify any media in the forwarded message
-    media_types = [
-        (message.document, message.document.file_name if message.document else None),
-        (message.photo[-1] if message.photo else None, f"photo_{message.photo[-1].file_unique_id}.jpg" if message.photo else None),
-        (message.video, message.video.file_name if message.video and message.video.file_name else f"video_{message.video.file_unique_id}.mp4" if message.video else None),
-        (message.audio, message.audio.file_name if message.audio and message.audio.file_name else f"audio_{message.audio.file_unique_id}.mp3" if message.audio else None),
-        (message.voice, f"voice_{message.voice.file_unique_id}.ogg" if message.voice else None),
-        (message.sticker, f"sticker_{message.sticker.file_unique_id}.webp" if message.sticker else None),
-        (message.animation, message.animation.file_name if message.animation and message.animation.file_name else f"animation_{message.animation.file_unique_id}.gif" if message.animation else None),
-        (message.video_note, f"video_note_{message.video_note.file_unique_id}.mp4" if message.video_note else None),
-    ]
-
-    for media, filename in media_types:
-        if media:
-            # We found a supported media type, process it
-            await process_file(update, context, media, filename)
-            return
-
-    # No supported media found in the forwarded message
+    """Handle forwarded messages without a file that can be backed up."""
+    # Forwarded files are picked up by handle_media, which is registered first
     await update.message.reply_text("No files found in the forwarded message that I can back up.")
 
 
-async def handle_generic_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """
-    Generic handler for all messages to catch any files that might have been missed.
-    This is a fallback to ensure all files are captured.
-    """
-    # Skip command messages and messages we've already handled with more specific handlers
-    if update.message.text and update.message.text.startswith('/'):
-        return
-
-    user_id = update.effective_user.id
-    if not check_user_authorized(user_id):
-        return
-
-    message = update.message
-    file_processed = False
-
-    # Check for any type of file that might be present in the message
-    if message.document:
-        await process_file(update, context, message.document, message.document.file_name)
-        file_processed = True
-
-    if message.photo:
-        photo = message.photo[-1]  # Get the largest photo
-        await process_file(update, context, photo, f"photo_{photo.file_unique_id}.jpg")
-        file_processed = True
-
-    if message.video:
-        filename = message.video.file_name if message.video.file_name else f"video_{message.video.file_unique_id}.mp4"
-        await process_file(update, context, message.video, filename)
-        file_processed = True
-
-    if message.audio:
-        filename = message.audio.file_name if message.audio.file_name else f"audio_{message.audio.file_unique_id}.mp3"
-        await process_file(update, context, message.audio, filename)
-        file_processed = True
-
-    if message.voice:
-        await process_file(update, context, message.voice, f"voice_{message.voice.file_unique_id}.ogg")
-        file_processed = True
-
-    if message.sticker:
-        extension = "webp"
-        if message.sticker.is_animated:
-            extension = "tgs"
-        elif message.sticker.is_video:
-            extension = "webm"
-        await process_file(update, context, message.sticker, f"sticker_{message.sticker.file_unique_id}.{extension}")
-        file_processed = True
-
-    if message.animation:
-        filename = message.animation.file_name if message.animation.file_name else f"animation_{message.animation.file_unique_id}.gif"
-        await process_file(update, context, message.animation, filename)
-        file_processed = True
-
-    if message.video_note:
-        await process_file(update, context, message.video_note, f"video_note_{message.video_note.file_unique_id}.mp4")
-        file_processed = True
-
-    # We don't want to send "No file found" messages for regular text messages
-    # So only respond if it seems like the user was trying to send a file
-    if not file_processed and (message.caption or message.forward_date):
-        await update.message.reply_text(
-            "I didn't find any files to back up in this message. "
-            "Please send me a file directly or forward a message containing a file."
-        )
+async def iter_file_chunks(http_client: httpx.AsyncClient, file: File):
+    """Yield the content of a Telegram file as it is downloaded."""
+    async with http_client.stream("GET", file.file_path) as response:
+        # Not raise_for_status(), its error includes the URL and so the bot token
+        if response.is_error:
+            raise RuntimeError(f"Telegram file download failed with HTTP {response.status_code}")
+        async for chunk in response.aiter_bytes():
+            yield chunk
 
 
 async def process_file(update: Update, context: ContextTypes.DEFAULT_TYPE, file_obj, filename: str) -> None:
     """Process and backup a file from Telegram."""
+    history = context.bot_data["backup_history"]
     try:
+        # Skip files that were already backed up, e.g. forwarded again
+        if file_obj.file_unique_id in history:
+            await update.message.reply_text(f"ℹ️ {filename} already backed up, skipped")
+            return
+
         # Reply that we're processing the file
         status_message = await update.message.reply_text(f"Processing {filename}...")
 
-        # Download the file
-        with tempfile.NamedTemporaryFile(delete=False) as temp_file:
-            file_path = temp_file.name
-
         # Get the file from Telegram
         file = await context.bot.get_file(file_obj.file_id)
-        await file.download_to_drive(file_path)
-
-        # Update status
-        await status_message.edit_text(f"Backing up {filename}...")
 
-        # Backup the file
-        backup_manager = BackupManager()
-        success = backup_manager.backup_file(file_path, filename)
-
-        # Clean up the temp file
-        os.unlink(file_path)
+        # Backup the file, streaming the download straight into the upload
+        backup_manager = context.bot_data["backup_manager"]
+        chunks = iter_file_chunks(context.bot_data["http_client"], file)
+        success = await backup_manager.backup_stream(chunks, filename)
 
         if success:
+            history.add(file_obj.file_unique_id)
             await status_message.edit_text(f"✅ Successfully backed up {filename}")
         else:
             await status_message.edit_text(f"❌ Failed to back up {filename}")
 
     except Exception as e:
-        logger.error(f"Error processing file {filename}: {e}")
+        logger.error("Error processing file %s: %s", filename, e)
         # Try to send an error message if possible
         try:
             await update.message.reply_text(f"Error processing file: {e}")
@@ -409,45 +260,100 @@ async def process_file(update: Update, context: ContextTypes.DEFAULT_TYPE, file_
             pass
 
 
+async def post_init(application: Application) -> None:
+    """Open the HTTP client used to download files from Telegram."""
+    application.bot_data["http_client"] = httpx.AsyncClient()
+
+
+async def post_shutdown(application: Application) -> None:
+    """Close the SMB connections, the HTTP client and the history when the bot stops."""
+    await application.bot_data["backup_manager"].close()
+    await application.bot_data["http_client"].aclose()
+    application.bot_data["backup_history"].close()
+
+
 def main() -> None:
     """Start the bot."""
+    # Enable logging
+    logging.basicConfig(
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO
+    )
+    # Set higher logging level for httpx to avoid excessive log output
+    logging.getLogger("httpx").setLevel(logging.WARNING)
 
     if not TELEGRAM_BOT_TOKEN:
         logger.error("No bot token found. Set the TELEGRAM_BOT_TOKEN environment variable.")
         return
 
-    application = Application.builder().token(TELEGRAM_BOT_TOKEN).build()
+    try:
+        backup_manager = BackupManager()
+    except ValueError:
+        # The missing or invalid settings have already been logged
+        return
+
+    try:
+        backup_history = BackupHistory(BACKUP_HISTORY_FILE)
+    except sqlite3.Error as e:
+        logger.error("Cannot open BACKUP_HISTORY_FILE %s: %s", BACKUP_HISTORY_FILE, e)
+        return
+
+    # run_polling runs on the current event loop, make it uvloop when installed
+    if uvloop is not None:
+        asyncio.set_event_loop(uvloop.new_event_loop())
+
+    # Albums arrive as one update per file. Handle as many updates at once as
+    # there are pooled SMB connections, so their uploads run in parallel.
+    application = (
+        Application.builder()
+        .token(TELEGRAM_BOT_TOKEN)
+        .concurrent_updates(SMB_POOL_SIZE)
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
+
+    # Share one backup manager (and its SMB connection pool) between all handlers
+    application.bot_data["backup_manager"] = backup_manager
+    application.bot_data["backup_history"] = backup_history
+
+    # The SMB settings don't change while running, so neither do the /status replies
+    application.bot_data["status_ok"] = (
+        "✅ Bot is operational\n"
+        "✅ SMB connection successful\n"
+        f"Server: {backup_manager.smb_server}\n"
+        f"Share: {backup_manager.smb_share}\n"
+        f"Backup directory: {backup_manager.backup_directory}"
+    )
+    application.bot_data["status_fail"] = (
+        "✅ Bot is operational\n"
+        "❌ SMB connection failed\n"
+        "Please check your SMB server settings."
+    )
+
+    # Reject unauthorized users once, before the handlers below are tried
+    application.add_handler(TypeHandler(Update, auth_gate), group=-1)
 
     # Command handlers
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CommandHandler("help", help_command))
     application.add_handler(CommandHandler("status", status_command))
 
-    # File handlers for specific file types
-    application.add_handler(MessageHandler(filters.Document.ALL, handle_document))
-    application.add_handler(MessageHandler(filters.PHOTO, handle_photo))
-    application.add_handler(MessageHandler(filters.VIDEO, handle_video))
-    application.add_handler(MessageHandler(filters.AUDIO, handle_audio))
-    application.add_handler(MessageHandler(filters.VOICE, handle_voice))
-    application.add_handler(MessageHandler(filters.Sticker.ALL, handle_sticker))
-    application.add_handler(MessageHandler(filters.ANIMATION, handle_animation))
-    application.add_handler(MessageHandler(filters.VIDEO_NOTE, handle_video_note))
-
-    # Handler for forwarded messages
-    application.add_handler(MessageHandler(filters.FORWARDED, handle_forwarded_message))
+    # One handler for all supported file types
+    application.add_handler(MessageHandler(MEDIA_FILTER, handle_media))
 
-    # Generic handler to catch any other files we might have missed
-    # This should be registered last so it doesn't override more specific handlers
-    application.add_handler(MessageHandler(filters.ALL, handle_generic_message))
+    # Handler for forwarded messages without a supported file
+    application.add_handler(MessageHandler(filters.FORWARDED, handle_forwarded_message))
 
     # Log startup
     logger.info("Starting bot...")
     if AUTHORIZED_USER_ID:
-        logger.info(f"Authorized user ID: {AUTHORIZED_USER_ID}")
+        logger.info("Authorized user ID: %s", AUTHORIZED_USER_ID)
     else:
         logger.warning("No authorized user ID set! Set the AUTHORIZED_USER_ID environment variable.")
 
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    # Only messages are handled, don't have Telegram send any other kind of update.
+    # Long polling lets Telegram hold each request open until an update arrives.
+    application.run_polling(allowed_updates=[Update.MESSAGE], timeout=30)
 
 if __name__ == "__main__":
     main()